@@ -9,20 +9,46 @@ import edge_tts # Library for Text-to-Speech (TTS)
 import os # For accessing environment variables (mainly for PORT now)
 import asyncio # For running asynchronous TTS function
 from openai import OpenAI # Client for the OpenAI API
+from openai import AuthenticationError # Raised on an invalid API key
+import httpx # Shared keep-alive connection pool for the OpenAI SDK
 from typing_extensions import override
 from openai import AssistantEventHandler # Handler for Assistant streaming
 from flask import Flask, request, jsonify, Response # Framework for the web server
 import traceback # For printing error tracebacks
 import re # For regular expressions, used in emotion detection
+import bisect # For mapping keyword matches onto sentence spans
+import queue # Thread-safe handoff of audio chunks to the Flask response generator
+import threading # Background thread that runs the async interaction pipeline
+import hashlib # Content hashes used as cache keys for transcriptions and TTS audio
+import io # In-memory buffers for WAV re-encoding
+import wave # Parsing/re-encoding the uploaded WAV before the Whisper upload
+import audioop # Downmix/resample PCM (stdlib on the Python 3.10 runtime)
+import pickle # Persists the response cache across restarts
 import json # For serializing the list of emotions
-
+import base64 # Audio frames in the NDJSON streaming endpoint
+from concurrent.futures import ThreadPoolExecutor # Overlapping independent OpenAI round-trips
+
+# orjson serializes JSON 2-5x faster in C; the endpoint payloads here are
+# small, so it stays optional and the stdlib path is a fine fallback.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Shared HTTP connection pool for all OpenAI calls (Whisper, Assistants).
+# Created once at import so TCP+TLS connections to api.openai.com are kept
+# alive across requests and re-initializations instead of paying a fresh
+# handshake (~100-300 ms) per call.
+_HTTPX = httpx.Client(
+    limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=300.0),
+    timeout=httpx.Timeout(600.0, connect=10.0), # Matches the SDK's own default total timeout
+)
 
 # Instances of OpenAI components, initialized after receiving API key.
 client = None
 vector_store = None
 assistant = None
-thread = None
-full_response = "" # Accumulates the Assistant's text response.
 ai_initialized_successfully = False # Flag to track AI initialization status
 
 # --- Emotion Analysis Components ---
@@ -30,117 +56,620 @@ ai_initialized_successfully = False # Flag to track AI initialization status
 happy_words = ["feliz", "content", "alegre", "maravilhos", "lind", "ador", "fantástic", "important", "conquista", "orgulho", "voz", "inpira", "prémio", "aplauso", "música", "cultura", "fado", "história", "tradição", "amor", "coração", "emoção"]
 sad_words = ["triste", "lament", "infeliz", "pena", "chorar", "saudade", "faleceu", "morreu", "desaparec", "perd", "solidão", "dor", "sofrer", "desilusão", "desapont", "tristeza", "luto", "memória", "complicad", "difícil", "desgosto", "desaparecimento", "perda", "vazio", "melancolia"]
 
+# Drops stems already covered by a shorter stem in the same list: the patterns
+# match each stem plus any \w* suffix, so "perd" already covers "perda" and
+# "desaparec" covers "desaparecimento". Keeping the longer forms only grows
+# the alternation the regex engine has to try at every word boundary.
+def _dedupe_stems(words):
+    kept = []
+    for word in sorted(words, key=len):
+        if not any(word.startswith(stem) for stem in kept):
+            kept.append(word)
+    return kept
+
+# Precompiled pattern for both keyword lists, built once at import time. A
+# single scan classifies every hit as happy or sad via named groups, so the
+# whole dictionary is matched in one C-level pass over the text, and
+# re.IGNORECASE makes a per-call text.lower() unnecessary.
+_EMOTION_RE = re.compile(
+    r"\b(?:(?P<happy>" + "|".join(map(re.escape, _dedupe_stems(happy_words))) + r")"
+    r"|(?P<sad>" + "|".join(map(re.escape, _dedupe_stems(sad_words))) + r"))\w*\b",
+    re.IGNORECASE)
+
+# First letters (both cases) of every keyword. Text containing none of these
+# characters cannot match either pattern, so scanning can be skipped entirely;
+# frozenset.isdisjoint runs at C speed and filters most neutral sentences.
+_HOT_CHARS = frozenset(w[0] for w in happy_words + sad_words) | \
+             frozenset(w[0].upper() for w in happy_words + sad_words)
+
+# Precompiled sentence boundary: after .!? followed by whitespace or directly by
+# the next sentence. The lookbehinds keep common abbreviations ("Sr.", "Dr.")
+# attached to their sentence, and runs of punctuation ("...") no longer produce
+# empty fragments.
+_SENT_SPLIT = re.compile(r"(?<!Sr\.)(?<!Dr\.)(?:(?<=[.!?])\s+|(?<=[.!?])(?=[^\s.!?]))")
+
 # Divides the text into sentences based on punctuation (.!?).
 def sentence_split(text):
-    # Add space after punctuation to ensure correct separation
-    text = text.replace('.', '. ').replace('!', '! ').replace('?', '? ')
-    # Split text into sentences based on punctuation followed by one or more spaces
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    # Filter out empty sentences that might result from splitting
-    return [s.strip() for s in sentences if s.strip()]
+    # One pass with the precompiled pattern instead of three str.replace
+    # passes plus an uncompiled split.
+    return [s for s in (part.strip() for part in _SENT_SPLIT.split(text)) if s]
 
 # Detects simple emotion (happy/sad/neutral) in the text.
 def detect_emotion(text):
-    text = text.lower()
-    score = {"happy": 0, "sad": 0}
-
-    for word in happy_words:
-        # Use regex to find words that start with the happy/sad word
-        matches = re.findall(r"\b" + word + r"\w*\b", text)
-        score["happy"] += len(matches)
+    # Fast path: no keyword can start here, so skip the regex scan.
+    if _HOT_CHARS.isdisjoint(text):
+        return 0 # neutral
 
-    for word in sad_words:
-        # Use regex to find words that start with the happy/sad word
-        matches = re.findall(r"\b" + word + r"\w*\b", text)
-        score["sad"] += len(matches)
+    # One scan classifies all keyword hits via the named groups.
+    happy = sad = 0
+    for match in _EMOTION_RE.finditer(text):
+        if match.lastgroup == "happy":
+            happy += 1
+        else:
+            sad += 1
 
-    if score["happy"] == score["sad"] == 0:
+    if happy == sad == 0:
         return 0 # neutral
-    elif score["happy"] > score["sad"]:
+    elif happy > sad:
         return 1 # happy
     else:
         return 2 # sad
 
 # Analyzes text sentence by sentence to detect emotion.
+# Scans the whole text once per keyword pattern and buckets the matches by
+# sentence offset, instead of re-scanning each sentence individually.
 def analyze_text(text):
-    sentences = sentence_split(text)
+    if not text:
+        return []
+
+    # Sentence spans: split points from the precompiled pattern, then drop
+    # whitespace-only fragments (they can never contain keyword matches).
+    starts = [0] + [m.end() for m in _SENT_SPLIT.finditer(text)]
+    ends = starts[1:] + [len(text)]
+    sentences = [] # Stripped sentence text
+    bounds = [] # Start offset of each kept sentence, for bisect
+    for start, end in zip(starts, ends):
+        sentence = text[start:end].strip()
+        if sentence:
+            sentences.append(sentence)
+            bounds.append(start)
+
+    if not sentences:
+        return []
+
+    # Fast path: no keyword can occur anywhere, so every sentence is neutral.
+    if _HOT_CHARS.isdisjoint(text):
+        return [(sentence, 0) for sentence in sentences]
+
+    # One pass over the full text; assign each classified match to the
+    # sentence whose span contains it.
+    happy = [0] * len(sentences)
+    sad = [0] * len(sentences)
+    for match in _EMOTION_RE.finditer(text):
+        index = bisect.bisect_right(bounds, match.start()) - 1
+        if match.lastgroup == "happy":
+            happy[index] += 1
+        else:
+            sad[index] += 1
+
+    emotions = []
+    for i, sentence in enumerate(sentences):
+        if happy[i] == sad[i] == 0:
+            emotion = 0 # neutral
+        elif happy[i] > sad[i]:
+            emotion = 1 # happy
+        else:
+            emotion = 2 # sad
+        emotions.append((sentence, emotion)) # Store sentence and emotion code
+    return emotions
+
+# Classifies a list of already-split segments in one batch: the segments are
+# joined and scanned in a single pass instead of running the keyword scan once
+# per segment, so the per-call overhead is paid once per response.
+def analyze_segments(segments):
+    if not segments:
+        return []
+
+    joined = "\n".join(segments)
+    # Fast path: no keyword can occur in any segment.
+    if _HOT_CHARS.isdisjoint(joined):
+        return [(segment, 0) for segment in segments]
+
+    # Start offset of each segment inside the joined text, for bisect.
+    bounds = []
+    offset = 0
+    for segment in segments:
+        bounds.append(offset)
+        offset += len(segment) + 1 # +1 for the "\n" separator
+
+    happy = [0] * len(segments)
+    sad = [0] * len(segments)
+    for match in _EMOTION_RE.finditer(joined):
+        index = bisect.bisect_right(bounds, match.start()) - 1
+        if match.lastgroup == "happy":
+            happy[index] += 1
+        else:
+            sad[index] += 1
+
     emotions = []
-    for sentence in sentences:
-        if sentence: # Ensure the sentence is not empty after stripping
-            emotion = detect_emotion(sentence)
-            emotions.append((sentence, emotion)) # Store sentence and emotion code
+    for i, segment in enumerate(segments):
+        if happy[i] == sad[i] == 0:
+            emotion = 0 # neutral
+        elif happy[i] > sad[i]:
+            emotion = 1 # happy
+        else:
+            emotion = 2 # sad
+        emotions.append((segment, emotion))
     return emotions
 
+# --- Persistent background event loop ---
+# Spinning up an event loop per request (asyncio.run) tears down edge-tts's
+# underlying connections every time, paying DNS + TLS handshake to the TTS
+# service on each call. One long-lived loop in a daemon thread lets connection
+# state survive across requests; coroutines are submitted to it thread-safely.
+_LOOP = asyncio.new_event_loop()
+# Blocking OpenAI SDK calls are pushed off the loop via run_in_executor; a
+# persistent pool keeps those worker threads warm across requests instead of
+# relying on the loop's lazily-created default executor.
+_LOOP.set_default_executor(ThreadPoolExecutor(max_workers=8, thread_name_prefix="musicalia-io"))
+threading.Thread(target=_LOOP.run_forever, name="musicalia-async-loop", daemon=True).start()
+
+# Bounds concurrent Edge TTS syntheses: with threaded serving several users
+# can be in flight at once, and unbounded outbound synthesis risks service-side
+# rate limiting (429s).
+TTS_CONCURRENT_REQUESTS = 3
+_TTS_SEMAPHORE = asyncio.Semaphore(TTS_CONCURRENT_REQUESTS)
+
 # --- Flask App Initialization ---
 app = Flask(__name__)
 
+# JSON response helper for the HTTP endpoints: uses orjson when installed,
+# otherwise defers to Flask's jsonify.
+def _json_response(payload, status):
+    if orjson is not None:
+        return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+    response = jsonify(payload)
+    response.status_code = status
+    return response
+
+# Sentences shorter than this are merged with the next one before being sent
+# to TTS, to avoid wasting a synthesis round-trip on tiny fragments.
+_MIN_TTS_SENTENCE_LEN = 10
+
+# Whisper resamples everything to 16 kHz mono internally, so uploading the
+# raw 44.1/48 kHz (possibly stereo) Unity recording wastes 3-6x the bytes.
+_WHISPER_SAMPLE_RATE = 16000
+
+# Re-encodes an uploaded WAV to 16 kHz mono 16-bit PCM before the Whisper
+# upload, using only the stdlib (wave + audioop). Anything unparseable or
+# already compact is returned unchanged.
+def _downsample_wav_for_whisper(wav_bytes):
+    try:
+        with wave.open(io.BytesIO(wav_bytes), "rb") as wav_in:
+            channels = wav_in.getnchannels()
+            sample_width = wav_in.getsampwidth()
+            rate = wav_in.getframerate()
+            frames = wav_in.readframes(wav_in.getnframes())
+
+        if channels not in (1, 2):
+            return wav_bytes # Unexpected layout; send as-is.
+        if channels == 1 and sample_width == 2 and rate <= _WHISPER_SAMPLE_RATE:
+            return wav_bytes # Already compact; nothing to gain.
+
+        if sample_width != 2:
+            if sample_width == 1:
+                # 8-bit WAV PCM is unsigned; recenter around zero before the
+                # signed width conversion or silence becomes full-scale noise.
+                frames = audioop.bias(frames, 1, -128)
+            frames = audioop.lin2lin(frames, sample_width, 2)
+        if channels == 2:
+            frames = audioop.tomono(frames, 2, 0.5, 0.5)
+        if rate > _WHISPER_SAMPLE_RATE:
+            frames, _ = audioop.ratecv(frames, 2, 1, rate, _WHISPER_SAMPLE_RATE, None)
+            rate = _WHISPER_SAMPLE_RATE
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_out:
+            wav_out.setnchannels(1)
+            wav_out.setsampwidth(2)
+            wav_out.setframerate(rate)
+            wav_out.writeframes(frames)
+        return buffer.getvalue()
+    except Exception as e:
+        print(f"WAV downsampling failed, sending original audio: {e}")
+        return wav_bytes
+
+# Leading/trailing silence still gets uploaded and transcribed; an RMS-based
+# endpoint trim cuts those bytes before the Whisper call. Frames quieter than
+# this (16-bit RMS) count as silence.
+_SILENCE_RMS_THRESHOLD = 250
+_SILENCE_FRAME_MS = 30 # RMS window size
+_SILENCE_PAD_FRAMES = 2 # Frames of context kept around the detected speech
+
+# Trims leading/trailing silence from a PCM WAV (stdlib only, like the
+# downsampler above). Returns (wav_bytes, has_speech); has_speech is False
+# when the whole clip is silent, letting the caller skip Whisper entirely.
+def _trim_silence_for_whisper(wav_bytes):
+    try:
+        with wave.open(io.BytesIO(wav_bytes), "rb") as wav_in:
+            channels = wav_in.getnchannels()
+            sample_width = wav_in.getsampwidth()
+            rate = wav_in.getframerate()
+            frames = wav_in.readframes(wav_in.getnframes())
+
+        if sample_width != 2 or not frames:
+            return wav_bytes, True # Unexpected layout; send as-is.
+
+        bytes_per_frame = channels * sample_width
+        window = max(1, rate * _SILENCE_FRAME_MS // 1000) * bytes_per_frame
+        voiced = [audioop.rms(frames[i:i + window], sample_width) > _SILENCE_RMS_THRESHOLD
+                  for i in range(0, len(frames), window)]
+
+        if not any(voiced):
+            return wav_bytes, False # Nothing but silence.
+
+        first = max(0, voiced.index(True) - _SILENCE_PAD_FRAMES)
+        last = min(len(voiced), len(voiced) - voiced[::-1].index(True) + _SILENCE_PAD_FRAMES)
+        trimmed = frames[first * window:last * window]
+        if len(trimmed) == len(frames):
+            return wav_bytes, True # No silence worth cutting.
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_out:
+            wav_out.setnchannels(channels)
+            wav_out.setsampwidth(sample_width)
+            wav_out.setframerate(rate)
+            wav_out.writeframes(trimmed)
+        return buffer.getvalue(), True
+    except Exception as e:
+        print(f"Silence trim failed, sending audio as-is: {e}")
+        return wav_bytes, True
+
+# --- Caches for repeated work ---
+# During a live show the same handful of questions (and the same canned
+# refusals from the Assistant) come up over and over; caching skips the
+# Whisper and Edge TTS round-trips for exact repeats.
+_TRANSCRIPTION_CACHE = {} # sha256 of the raw WAV bytes -> transcription text
+_TTS_CACHE = {} # sha256 of a cleaned sentence -> synthesized MP3 bytes
+_CACHE_MAX_ENTRIES = 512
+
+# Inserts into a bounded cache, evicting the oldest entry once full
+# (dicts preserve insertion order).
+def _cache_put(cache, key, value, max_entries=_CACHE_MAX_ENTRIES):
+    if len(cache) >= max_entries:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+# --- Single-flight coalescing of identical in-flight requests ---
+# The caches only help once a first answer has landed; two byte-identical
+# uploads racing through the pipeline at the same time (client retries,
+# double taps) would still each pay Whisper + LLM + TTS. The second request
+# instead waits for the first to finish and is then served from the caches.
+_INFLIGHT = {} # sha256 of the raw WAV bytes -> threading.Event
+_INFLIGHT_LOCK = threading.Lock()
+
+# Registers interest in a digest. Returns (event, owner): the owner runs the
+# pipeline and must eventually call _inflight_end; others wait on the event.
+def _inflight_begin(digest):
+    with _INFLIGHT_LOCK:
+        event = _INFLIGHT.get(digest)
+        if event is not None:
+            return event, False
+        event = threading.Event()
+        _INFLIGHT[digest] = event
+        return event, True
+
+# Releases anyone waiting on a digest (safe to call more than once).
+def _inflight_end(digest):
+    with _INFLIGHT_LOCK:
+        event = _INFLIGHT.pop(digest, None)
+    if event is not None:
+        event.set()
+
+# --- Full-response cache ---
+# Keyed by the normalized transcription; a hit returns the stored MP3 and
+# emotion codes straight away, skipping the LLM and TTS entirely. The cache
+# is pickled to disk (best effort) so it survives server restarts — useful on
+# Render, where idle instances are recycled. Entries hold whole MP3s, so the
+# cap is kept smaller than the text caches'.
+_RESPONSE_CACHE_FILE = ".musicalia_response_cache.pkl"
+_RESPONSE_CACHE_MAX = 128
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+_WS_RE = re.compile(r"\s+")
+
+# Lowercase, strip punctuation, collapse whitespace — so trivial phrasing
+# differences ("Quem és tu?" / "quem és tu!") still hit the cache.
+def _normalize_transcription(text):
+    return _WS_RE.sub(" ", _PUNCT_RE.sub("", text.lower())).strip()
+
+def _load_response_cache():
+    try:
+        if os.path.exists(_RESPONSE_CACHE_FILE):
+            with open(_RESPONSE_CACHE_FILE, "rb") as cache_file:
+                return pickle.load(cache_file)
+    except Exception as e:
+        print(f"Could not load response cache: {e}")
+    return {}
+
+_RESPONSE_CACHE = _load_response_cache() # normalized transcription -> (MP3 bytes, emotion codes)
+
+_RESPONSE_CACHE_SAVE_LOCK = threading.Lock() # Saves run on executor threads; one writer at a time.
+
+def _save_response_cache():
+    try:
+        with _RESPONSE_CACHE_SAVE_LOCK:
+            with open(_RESPONSE_CACHE_FILE, "wb") as cache_file:
+                pickle.dump(_RESPONSE_CACHE, cache_file)
+    except Exception as e:
+        print(f"Could not persist response cache: {e}")
+
+# --- Per-session conversation state ---
+# A single module-level conversation thread would race under threaded serving:
+# concurrent users would interleave their messages in one OpenAI thread and
+# get answers built on each other's context. Each client gets its own Session,
+# keyed by the X-Session-Id header sent by Unity; requests without the header
+# share the "default" session, which matches the old single-user behavior.
+class Session:
+    def __init__(self, thread):
+        self.thread = thread # OpenAI conversation thread for this client
+        self.lock = threading.Lock() # The API allows one active run per thread
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Returns the session for the given id, creating its conversation thread on
+# first use. Requires the OpenAI client to be initialized.
+def _get_session(session_id):
+    with _sessions_lock:
+        session = _sessions.get(session_id)
+        if session is None:
+            new_thread = client.beta.threads.create()
+            print(f"New Thread created for session '{session_id}': {new_thread.id}")
+            session = Session(new_thread)
+            _sessions[session_id] = session
+        return session
+
+# Small pool used by the audio endpoint to overlap the session thread-creation
+# round-trip with Whisper transcription.
+_SESSION_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="musicalia-session")
+
 # --- EventHandler to process Assistant text streaming ---
+# Besides accumulating the full response, the handler flushes each completed
+# sentence into an asyncio.Queue so TTS synthesis can start while the
+# Assistant is still generating the rest of the reply.
 class EventHandler(AssistantEventHandler):
-    # Clears the previous response when new text starts.
+    def __init__(self, loop=None, sentence_queue=None):
+        super().__init__()
+        self._loop = loop # Event loop owning the sentence queue
+        self._queue = sentence_queue # Receives completed sentences (None = end of stream)
+        self._pending = "" # Text buffered since the last flushed sentence boundary
+        self._chunks = [] # This run's text deltas; instance state, so concurrent runs cannot clobber each other
+        self._flushed = [] # Sentences flushed to TTS, in spoken order
+
+    # Fires once per message part. Deliberately does NOT reset state: the
+    # handler instance is fresh per run, and on multi-part runs the sentences
+    # of earlier parts were already synthesized and streamed to the client, so
+    # dropping them here would desync the emotion codes from the audio sent.
     @override
     def on_text_created(self, text) -> None:
-        global full_response
-        full_response = ""
         pass
 
     # Adds each text chunk to the complete response.
+    # Appending to a list is O(1) per delta; repeated str += on long
+    # responses degrades to quadratic copying.
     @override
     def on_text_delta(self, delta, snapshot):
-        global full_response
-        full_response += delta.value
-
-# --- Function to generate audio from text with Edge TTS ---
+        self._chunks.append(delta.value)
+
+        if self._queue is None:
+            return
+
+        # Buffer the delta and flush any completed sentences to the queue.
+        self._pending += delta.value
+        parts = _SENT_SPLIT.split(self._pending)
+        if len(parts) > 1:
+            complete, self._pending = parts[:-1], parts[-1]
+            buffered = ""
+            for sentence in complete:
+                buffered = sentence if not buffered else buffered + " " + sentence
+                if len(buffered) >= _MIN_TTS_SENTENCE_LEN:
+                    self._emit(buffered)
+                    buffered = ""
+            if buffered: # Too short on its own; prepend to the trailing partial sentence.
+                self._pending = buffered + " " + self._pending if self._pending else buffered
+
+    # Flushes any trailing partial sentence and signals end of stream.
+    # Called after stream.until_done() returns.
+    def finish(self):
+        if self._queue is None:
+            return
+        remainder = self._pending.strip()
+        if remainder:
+            self._emit(remainder)
+        self._pending = ""
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+    # The Assistant stream runs in a worker thread, so hand sentences to the
+    # event loop thread-safely.
+    def _emit(self, sentence):
+        sentence = sentence.strip()
+        self._flushed.append(sentence)
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, sentence)
+
+    # Full response text accumulated so far.
+    def response_text(self):
+        return "".join(self._chunks)
+
+    # Sentences handed to TTS so far, in spoken order. Each one maps 1:1 to
+    # an audio segment in the outbound stream.
+    def flushed_sentences(self):
+        return list(self._flushed)
+
+# --- Functions to generate audio from text with Edge TTS ---
 # Streaming edge_tts typically generates bytes in MP3 or similar format.
-async def text_to_speech_bytes(text):
+# Yields each audio chunk as the service produces it, so callers can forward
+# bytes downstream without waiting for the whole synthesis to finish.
+async def text_to_speech_stream(text):
     voice = 'pt-PT-RaquelNeural' # Portuguese voice.
     try:
-        communicate = edge_tts.Communicate(text, voice)
-        audio_chunks = []
-        async for chunk in communicate.stream():
-            if chunk["type"] == "audio":
-                audio_chunks.append(chunk["data"]) # Collect audio bytes.
-        return b"".join(audio_chunks) # Return all bytes together (MP3-like).
+        async with _TTS_SEMAPHORE: # Bound outbound synthesis concurrency.
+            communicate = edge_tts.Communicate(text, voice)
+            async for chunk in communicate.stream():
+                if chunk["type"] == "audio":
+                    yield chunk["data"] # Audio bytes as they arrive.
     except Exception as e:
         print(f"Error generating TTS audio: {e}")
-        return None
 
-# --- Processes interaction with OpenAI Assistant, generates audio, and analyzes emotion ---
-async def process_interaction_and_speak(user_transcription):
-    global full_response, client, assistant, thread, ai_initialized_successfully
+# Convenience wrapper that buffers the full synthesis into one bytes object.
+async def text_to_speech_bytes(text):
+    audio_chunks = []
+    async for chunk in text_to_speech_stream(text):
+        audio_chunks.append(chunk) # Collect audio bytes.
+    return b"".join(audio_chunks) if audio_chunks else None
+
+# High-frequency canned lines: the off-topic refusal the prompt mandates and a
+# short greeting. Synthesized once after initialization and stored in
+# _TTS_CACHE under the same key the pipeline uses, so the first off-topic
+# question of a show pays no TTS round-trip.
+_CANNED_TTS_SENTENCES = (
+    "Desculpa, só posso falar sobre Fado, Amália Rodrigues e a cultura portuguesa.",
+    "Olá! Eu sou a Musicalia. Pergunta-me o que quiseres sobre o Fado.",
+)
+
+def _prewarm_tts_cache():
+    for sentence in _CANNED_TTS_SENTENCES:
+        cleaned = clean_text_for_tts(sentence)
+        tts_key = hashlib.sha256(cleaned.encode("utf-8")).hexdigest()
+        if tts_key in _TTS_CACHE:
+            continue
+        try:
+            audio = asyncio.run_coroutine_threadsafe(
+                text_to_speech_bytes(cleaned), _LOOP
+            ).result(timeout=30)
+            if audio:
+                _cache_put(_TTS_CACHE, tts_key, audio)
+        except Exception as e:
+            print(f"TTS pre-warm failed for canned line: {e}")
+    print("TTS cache pre-warmed with canned lines.")
 
-    if not ai_initialized_successfully or not client or not assistant or not thread:
+# --- Processes interaction with OpenAI Assistant, generates audio, and analyzes emotion ---
+# Streams the result instead of returning it: audio chunks are pushed into the
+# thread-safe audio_queue (terminated by None; pass None when frames via
+# frame_queue are the only consumer) as TTS produces them, and the
+# emotion codes are published in result["emotion_codes"] as soon as the
+# Assistant finishes its text, with emotions_ready set at that point. This lets
+# the HTTP layer send the emotion header and start the body while later
+# sentences are still being synthesized.
+async def process_interaction_and_speak(session, user_transcription, audio_queue, result, emotions_ready, cache_key=None, on_complete=None, frame_queue=None):
+    global client, assistant, ai_initialized_successfully
+
+    if not ai_initialized_successfully or not client or not assistant or not session:
         print("Error: OpenAI components not initialized or initialization failed.")
-        return None, None # Return None for both in case of error
-
-    full_response = ""
+        result["error"] = "AI components not initialized"
+        emotions_ready.set()
+        if audio_queue is not None:
+            audio_queue.put(None)
+        if on_complete is not None:
+            on_complete()
+        return
 
     try:
-        # Add user message to the thread.
-        client.beta.threads.messages.create(
-            thread_id=thread.id, role="user", content=user_transcription
-        )
-
-        # Run the Assistant on the thread, using the handler to capture the text.
-        event_handler_instance = EventHandler()
+        # Run the Assistant on the session's thread, using the handler to
+        # capture the text. The blocking stream runs in a worker thread while
+        # this loop consumes completed sentences and synthesizes them
+        # immediately, so TTS overlaps with the Assistant still generating the
+        # rest of the response.
+        loop = asyncio.get_running_loop()
+        sentence_queue = asyncio.Queue()
+        event_handler_instance = EventHandler(loop, sentence_queue)
         print(f"Running Assistant for transcription: '{user_transcription}'")
-        with client.beta.threads.runs.stream(
-            thread_id=thread.id,
-            assistant_id=assistant.id,
-            # Instructions for Musicalia's persona and response rules.
-            instructions="Por favor, responde sempre em português de Portugal. \
-            Sempre que o utilizador se referir a ti, deve ser como 'Musicalia', um avatar feminino inspirado na Amália Rodrigues, a icónica cantora de Fado portuguesa.\
-            Por favor, responde sempre em português de Portugal. O utilizador é o Gil Ferreira, o responsável pelo espetáculo. \
-            Ele é um músico, professor e gestor cultural, nascido na Venezuela em 1981, e agora eleito em funções públicas.",
-            event_handler=event_handler_instance,
-        ) as stream:
-            stream.until_done() # Wait for the Assistant to finish.
 
+        def run_assistant_stream():
+            # One run at a time per conversation thread; the lock also keeps
+            # the message/run pair of concurrent requests from interleaving.
+            with session.lock:
+                # Add user message to the thread.
+                client.beta.threads.messages.create(
+                    thread_id=session.thread.id, role="user", content=user_transcription
+                )
+                # No per-run instructions override: it would replace (and
+                # re-bill) the persona already registered on the Assistant on
+                # every turn, and a byte-identical stable prefix is what lets
+                # provider-side prompt caching kick in. The persona and the
+                # user context live in instructions_text at initialization.
+                with client.beta.threads.runs.stream(
+                    thread_id=session.thread.id,
+                    assistant_id=assistant.id,
+                    event_handler=event_handler_instance,
+                ) as stream:
+                    stream.until_done() # Wait for the Assistant to finish.
+
+        async def run_assistant():
+            try:
+                await loop.run_in_executor(None, run_assistant_stream)
+            finally:
+                event_handler_instance.finish() # Flush the last sentence + end-of-stream marker.
+
+        # Consume sentences in FIFO order, forwarding each one's audio chunks
+        # to the outbound queue as Edge TTS produces them. Synthesis of a
+        # sentence overlaps with the Assistant still generating later ones.
+        # The full audio is also accumulated so the finished response can be
+        # stored in the response cache.
+        response_audio_parts = []
+
+        async def synthesize_sentences():
+            while True:
+                sentence = await sentence_queue.get()
+                if sentence is None:
+                    break
+                cleaned_sentence = clean_text_for_tts(sentence)
+                if not cleaned_sentence:
+                    continue
+
+                # Serve repeated sentences straight from the TTS cache.
+                tts_key = hashlib.sha256(cleaned_sentence.encode("utf-8")).hexdigest()
+                cached_audio = _TTS_CACHE.get(tts_key)
+                if cached_audio is not None:
+                    response_audio_parts.append(cached_audio)
+                    if audio_queue is not None:
+                        audio_queue.put(cached_audio)
+                    if frame_queue is not None: # Per-sentence frame for the NDJSON endpoint.
+                        frame_queue.put((detect_emotion(cleaned_sentence), cached_audio))
+                    continue
+
+                sentence_chunks = []
+                async for audio_chunk in text_to_speech_stream(cleaned_sentence):
+                    sentence_chunks.append(audio_chunk)
+                    if audio_queue is not None:
+                        audio_queue.put(audio_chunk)
+                if sentence_chunks:
+                    sentence_audio = b"".join(sentence_chunks)
+                    response_audio_parts.append(sentence_audio)
+                    _cache_put(_TTS_CACHE, tts_key, sentence_audio)
+                    if frame_queue is not None: # Per-sentence frame for the NDJSON endpoint.
+                        frame_queue.put((detect_emotion(cleaned_sentence), sentence_audio))
+
+        assistant_task = asyncio.create_task(run_assistant())
+        tts_task = asyncio.create_task(synthesize_sentences())
+        await assistant_task
+
+        full_response = event_handler_instance.response_text() # Join the deltas once, at stream end.
         ai_text_to_speak = clean_text_for_tts(full_response.strip()) # Get the full response text and remove leading/trailing spaces.
 
         if ai_text_to_speak:
             # Integrated Emotion Analysis
             print("\n--- Response Emotion Analysis ---")
-            analyzed_sentences = analyze_text(ai_text_to_speak)
+            # Analyze the sentences exactly as they were flushed to TTS, so
+            # each emotion code lines up with the audio segment Unity plays
+            # for it (short fragments were merged before synthesis). Falls
+            # back to the full-text analysis if nothing was flushed.
+            flushed_sentences = [s for s in
+                                 (clean_text_for_tts(fs) for fs in event_handler_instance.flushed_sentences())
+                                 if s]
+            if flushed_sentences:
+                analyzed_sentences = analyze_segments(flushed_sentences) # One scan for the whole batch.
+            else:
+                analyzed_sentences = analyze_text(ai_text_to_speak)
             emotion_labels = {0: "Neutral", 1: "Happy", 2: "Sad"}
             emotion_codes_list = []
             print("Analysis by sentence:")
@@ -148,27 +677,62 @@ async def process_interaction_and_speak(user_transcription):
                 print(f"[EMOTION] {emotion_labels[emotion_code]} ({emotion_code}) → {sentence}")
                 emotion_codes_list.append(emotion_code) # Collect only the codes
 
-            if not emotion_codes_list and analyzed_sentences: # If there is text but no codes (e.g. all neutral sentences from a single word response)
-                    emotion_codes_list = [0] # Default to neutral
-            elif not analyzed_sentences: # No sentences, implies no text to analyze
-                emotion_codes_list = [0] # Default to neutral if text was empty or whitespace
+            if not emotion_codes_list: # No sentences, implies no text to analyze
+                emotion_codes_list = [0] # Default to neutral
 
             print(f"Emotion codes to send: {emotion_codes_list}")
             print("------------------------------------")
-
-            # Generate audio for the text response.
-            print("Generating response audio...")
-            audio_bytes = await text_to_speech_bytes(ai_text_to_speak)
-
-            return audio_bytes, emotion_codes_list # Return audio bytes and the list of codes
+            result["emotion_codes"] = emotion_codes_list
         else:
             print("No text response generated by the Assistant.")
-            return None, [0] # Return None for audio and default neutral emotion
+            result["emotion_codes"] = [0] # Default neutral emotion for empty response
+
+        # The header can go out now; remaining sentences keep streaming below.
+        emotions_ready.set()
+        await tts_task # Wait for the last sentence's audio to be forwarded.
+
+        # Store the finished response so an identical question can be answered
+        # without touching the LLM or TTS at all.
+        if cache_key and response_audio_parts:
+            _cache_put(_RESPONSE_CACHE, cache_key,
+                       (b"".join(response_audio_parts), result["emotion_codes"]),
+                       _RESPONSE_CACHE_MAX)
+            # Pickling up to _RESPONSE_CACHE_MAX full MP3s is slow; on the
+            # loop thread it would stall chunk forwarding for every other
+            # session and hold back the single-flight release below. Run it
+            # best-effort on an executor thread without awaiting; the
+            # function handles its own errors and serializes writers.
+            loop.run_in_executor(None, _save_response_cache)
 
     except Exception as e:
         print(f"Error during OpenAI/TTS interaction: {e}")
         traceback.print_exc() # Print the error traceback for better debugging
-        return None, None # Return None for both in case of error
+        result["error"] = str(e)
+    finally:
+        emotions_ready.set() # No-op if already set; guards early-exit paths.
+        if audio_queue is not None:
+            audio_queue.put(None) # End-of-audio marker for the response generator.
+        if frame_queue is not None:
+            frame_queue.put(None) # End-of-frames marker for the NDJSON generator.
+        if on_complete is not None:
+            on_complete() # Releases single-flight waiters once the caches are filled.
+
+# Runs initialize_ai_components at most once at a time. A caller arriving
+# while another initialization is in flight (e.g. /initialize_ai during the
+# boot-time background attempt) blocks on the lock and then reuses the
+# outcome instead of starting a duplicate initialization.
+_init_lock = threading.Lock()
+
+def _initialize_ai_synchronized(api_key):
+    global ai_initialized_successfully
+    with _init_lock:
+        if not ai_initialized_successfully:
+            ai_initialized_successfully = initialize_ai_components(api_key)
+            if ai_initialized_successfully:
+                # Pre-render the canned lines off the init path; the cache is
+                # simply cold for them if synthesis fails.
+                threading.Thread(target=_prewarm_tts_cache, daemon=True).start()
+        return ai_initialized_successfully
 
 # --- HTTP Endpoint to receive API Key and Initialize AI Components ---
 @app.route('/initialize_ai', methods=['POST'])
@@ -178,27 +742,60 @@ def initialize_ai_endpoint():
 
     if ai_initialized_successfully and client is not None:
         print("AI components already initialized.")
-        return jsonify({"message": "AI components already initialized"}), 200
+        return _json_response({"message": "AI components already initialized"}, 200)
 
     data = request.get_json()
     if not data or 'api_key' not in data:
         print("Error: API key not provided in request.")
-        return jsonify({"error": "API key not provided"}), 400
+        return _json_response({"error": "API key not provided"}, 400)
 
     api_key = data['api_key']
     if not api_key.strip():
         print("Error: Received empty API key.")
-        return jsonify({"error": "Empty API key received"}), 400
+        return _json_response({"error": "Empty API key received"}, 400)
 
     print("Attempting to initialize AI components with provided API key...")
-    if initialize_ai_components(api_key):
-        ai_initialized_successfully = True
+    if _initialize_ai_synchronized(api_key):
         print("AI components initialized successfully via /initialize_ai.")
-        return jsonify({"message": "AI initialized successfully"}), 200
+        return _json_response({"message": "AI initialized successfully"}, 200)
     else:
-        ai_initialized_successfully = False
         print("Failed to initialize AI components via /initialize_ai.")
-        return jsonify({"error": "AI initialization failed on server"}), 500
+        return _json_response({"error": "AI initialization failed on server"}, 500)
+
+# Resolves the transcription for an uploaded WAV: transcription cache first,
+# then downsample + silence trim, then Whisper. Silent clips return "" without
+# an API call. Shared by both audio endpoints.
+def _resolve_transcription(audio_bytes, audio_digest):
+    user_transcription = _TRANSCRIPTION_CACHE.get(audio_digest)
+    if user_transcription is not None:
+        print("Transcription served from cache.")
+        return user_transcription
+
+    # Shrink the upload: Whisper resamples to 16 kHz mono anyway.
+    whisper_audio = _downsample_wav_for_whisper(audio_bytes)
+    if len(whisper_audio) < len(audio_bytes):
+        print(f"Audio downsampled for upload: {len(audio_bytes)} -> {len(whisper_audio)} bytes.")
+
+    # Drop leading/trailing silence; a fully silent clip skips the
+    # Whisper round-trip altogether.
+    whisper_audio, has_speech = _trim_silence_for_whisper(whisper_audio)
+    if not has_speech:
+        print("Audio contains no speech; skipping transcription.")
+        _cache_put(_TRANSCRIPTION_CACHE, audio_digest, "")
+        return ""
+
+    print("Sending for transcription (OpenAI Whisper-1)...")
+    # The Whisper-1 API accepts the file directly.
+    transcription_response = client.audio.transcriptions.create(
+        model="whisper-1", # Specify the Whisper-1 model
+        file=("audio.wav", whisper_audio, "audio/wav"), # File name, bytes, and MIME type
+        language="pt", # Improves accuracy with Portuguese language
+        response_format="text" # Plain text: skips the JSON envelope on the wire
+    )
+
+    user_transcription = transcription_response.strip() # response_format="text" returns the string directly
+    _cache_put(_TRANSCRIPTION_CACHE, audio_digest, user_transcription)
+    return user_transcription
 
 # --- HTTP Endpoint to receive audio and return audio + emotion ---
 # Receives audio (WAV from Unity), transcribes, interacts with AI, and returns audio (MP3) + emotion (Header).
@@ -209,12 +806,12 @@ def interact_audio_endpoint():
 
     if not ai_initialized_successfully or not client:
         print("Error: AI components not initialized. Please send API key to /initialize_ai first.")
-        return jsonify({"error": "AI not initialized. Send API key to /initialize_ai first."}), 403 # Forbidden
+        return _json_response({"error": "AI not initialized. Send API key to /initialize_ai first."}, 403) # Forbidden
 
     # 1. Receive the audio file from the client (Unity).
     if 'file' not in request.files:
         print("Error: No audio file provided.")
-        return jsonify({"error": "No audio file provided"}), 400
+        return _json_response({"error": "No audio file provided"}, 400)
 
     audio_file = request.files['file']
     audio_bytes = audio_file.read() # Unity sends WAV (implemented there).
@@ -222,19 +819,38 @@ def interact_audio_endpoint():
 
     # 2. Send audio for Transcription (Speech-to-Text) with OpenAI Whisper-1.
     # client is already initialized with the API key here
-    print("Sending for transcription (OpenAI Whisper-1)...")
+    audio_digest = None
+    inflight_owner = False # True while this request owns the single-flight slot.
     try:
-        # The Whisper-1 API accepts the file directly.
-        transcription_response = client.audio.transcriptions.create(
-            model="whisper-1", # Specify the Whisper-1 model
-            file=("audio.wav", audio_bytes, "audio/wav"), # File name, bytes, and MIME type
-            language="pt" # Improves accuracy with Portuguese language
-        )
-
-        user_transcription = transcription_response.text.strip() # The Whisper-1 response has the text directly
+        # Conversation state for this client (thread created on first use).
+        # Resolving the session costs a thread-creation round-trip the first
+        # time, so it runs concurrently with the transcription below; Whisper-1
+        # offers no partial-hypothesis streaming over the API, so the result is
+        # only joined once the final transcription is known.
+        session_future = _SESSION_POOL.submit(_get_session, request.headers.get('X-Session-Id', 'default'))
+
+        # Byte-identical uploads (retries, repeated canned questions) skip the
+        # Whisper round-trip entirely.
+        audio_digest = hashlib.sha256(audio_bytes).hexdigest()
+
+        # Single-flight: if a byte-identical upload is already mid-pipeline,
+        # wait for it to finish instead of running a duplicate
+        # Whisper + LLM + TTS pass; the caches below then answer directly.
+        inflight_event, inflight_owner = _inflight_begin(audio_digest)
+        if not inflight_owner:
+            print("Identical request already in flight; waiting for its result.")
+            inflight_event.wait(timeout=120) # On timeout, fall through and process normally.
+
+        user_transcription = _resolve_transcription(audio_bytes, audio_digest)
+        # Drop the raw WAV: this frame stays alive through the multi-second
+        # LLM/TTS phase below, and holding megabytes of audio across it causes
+        # a per-request allocation spike for nothing.
+        del audio_bytes
         print(f"Transcription: '{user_transcription}'")
 
         if not user_transcription:
+            if inflight_owner:
+                _inflight_end(audio_digest) # Nothing to wait for.
             print("Transcription resulted in empty text.")
             empty_response = Response(mimetype='audio/mpeg') # Empty audio
             empty_response.headers['X-Musicalia-Emotion-Codes'] = "0" # Neutral for empty
@@ -243,24 +859,81 @@ def interact_audio_endpoint():
             return empty_response
 
 
-        # 3. Process transcription with OpenAI, get response audio and emotion analysis.
+        # Full-response cache: an identical (normalized) question answered
+        # before returns its stored MP3 + emotion codes in milliseconds.
+        normalized_transcription = _normalize_transcription(user_transcription)
+        cached_response = _RESPONSE_CACHE.get(normalized_transcription)
+        if cached_response is not None:
+            if inflight_owner:
+                _inflight_end(audio_digest) # Served from cache; release waiters.
+            cached_audio, cached_codes = cached_response
+            print("Full response served from cache.")
+            response = Response(cached_audio, mimetype='audio/mpeg')
+            response.headers['X-Musicalia-Emotion-Codes'] = ",".join(map(str, cached_codes if cached_codes else [0]))
+            response.status_code = 200
+            return response
+
+        # 3. Process transcription with OpenAI; audio chunks stream into a
+        # queue while the emotion codes become available at end of LLM text.
         print("Processing with OpenAI...")
-        ai_audio_response_bytes, emotion_codes_list = asyncio.run(process_interaction_and_speak(user_transcription))
+        session = session_future.result() # Overlapped with transcription above.
+        audio_queue = queue.Queue() # TTS chunks, terminated by None
+        result = {} # Filled with "emotion_codes" or "error" by the pipeline
+        emotions_ready = threading.Event()
+        # The pipeline releases the single-flight slot once its caches are
+        # filled, so a coalesced waiter always finds the stored answer.
+        on_complete = (lambda digest=audio_digest: _inflight_end(digest)) if inflight_owner else None
+        asyncio.run_coroutine_threadsafe(
+            process_interaction_and_speak(session, user_transcription, audio_queue, result, emotions_ready,
+                                          cache_key=normalized_transcription, on_complete=on_complete),
+            _LOOP,
+        )
+        inflight_owner = False # Ownership handed to the pipeline.
+        emotions_ready.wait() # Headers need the emotion codes before the body starts.
 
-        # 4. Send response audio + emotion back to the client (Unity).
-        if ai_audio_response_bytes is not None: # Check if audio generation was successful
+        # 4. Stream the response audio + emotion back to the client (Unity).
+        if "error" not in result:
             print("\nSending response audio and emotion...")
 
             # Format the list of emotion codes for an HTTP header.
+            emotion_codes_list = result.get("emotion_codes")
             emotion_header_value = ",".join(map(str, emotion_codes_list if emotion_codes_list else [0])) # Default to neutral if list is empty
 
-            # Create the HTTP response
-            response = Response(ai_audio_response_bytes, mimetype='audio/mpeg')
+            # Generator that relays TTS chunks as they are produced, so the
+            # client starts receiving audio before synthesis has finished.
+            # Writes grow progressively: the first chunks ship immediately for
+            # a fast time-to-first-audio, then queued backlog is coalesced
+            # into doubling batches to cut per-write transfer overhead.
+            def audio_chunk_generator():
+                target_size = 4096
+                while True:
+                    audio_chunk = audio_queue.get()
+                    if audio_chunk is None:
+                        break
+                    batch = [audio_chunk]
+                    batched = len(audio_chunk)
+                    # Drain already-queued chunks up to the current batch size;
+                    # never block waiting for more.
+                    while batched < target_size:
+                        try:
+                            extra = audio_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if extra is None:
+                            yield b"".join(batch)
+                            return
+                        batch.append(extra)
+                        batched += len(extra)
+                    yield b"".join(batch) if len(batch) > 1 else audio_chunk
+                    target_size = min(target_size * 2, 65536)
+
+            # Create the chunked HTTP response
+            response = Response(audio_chunk_generator(), mimetype='audio/mpeg')
             response.headers['X-Musicalia-Emotion-Codes'] = emotion_header_value
             response.status_code = 200
 
             print(f"Emotion Header sent: X-Musicalia-Emotion-Codes: {emotion_header_value}")
-            print(f"Content: Audio ({len(ai_audio_response_bytes)} bytes)")
+            print("Content: Audio (chunked stream)")
 
             return response # Return the response with audio in the body and emotion in the header
         else:
@@ -273,14 +946,145 @@ def interact_audio_endpoint():
 
 
     except Exception as e:
+        if inflight_owner and audio_digest:
+            _inflight_end(audio_digest) # Never leave waiters hanging on a failure.
         print(f"Error in /interact_audio endpoint: {e}")
         traceback.print_exc()
         return jsonify({"error": f"Internal server error: {e}"}), 500
 
+# --- Streaming HTTP Endpoint: per-sentence NDJSON frames ---
+# The header-based protocol above must wait for the full emotion list before
+# the first body byte. This variant streams one JSON line per spoken sentence,
+# each carrying its own emotion code and base64 MP3, so Unity can animate and
+# play the first sentence while later ones are still being synthesized. The
+# original endpoint is kept for backward compatibility.
+@app.route('/interact_audio_stream', methods=['POST'])
+def interact_audio_stream_endpoint():
+    global ai_initialized_successfully, client
+    print("\n--- POST Request Received to /interact_audio_stream ---")
+
+    if not ai_initialized_successfully or not client:
+        print("Error: AI components not initialized. Please send API key to /initialize_ai first.")
+        return _json_response({"error": "AI not initialized. Send API key to /initialize_ai first."}, 403) # Forbidden
+
+    if 'file' not in request.files:
+        print("Error: No audio file provided.")
+        return _json_response({"error": "No audio file provided"}, 400)
+
+    audio_bytes = request.files['file'].read()
+    print(f"Audio received: {len(audio_bytes)} bytes.")
+
+    # One NDJSON line per frame.
+    def frame_line(seq, emotion, audio_bytes_frame, final):
+        return json.dumps({
+            "seq": seq,
+            "emotion": emotion,
+            "audio": base64.b64encode(audio_bytes_frame).decode("ascii") if audio_bytes_frame else "",
+            "final": final,
+        }) + "\n"
+
+    audio_digest = None
+    inflight_owner = False # True while this request owns the single-flight slot.
+    try:
+        # Same front half as /interact_audio: overlapped session resolution,
+        # single-flight coalescing, and the shared transcription path.
+        session_future = _SESSION_POOL.submit(_get_session, request.headers.get('X-Session-Id', 'default'))
+        audio_digest = hashlib.sha256(audio_bytes).hexdigest()
+
+        inflight_event, inflight_owner = _inflight_begin(audio_digest)
+        if not inflight_owner:
+            print("Identical request already in flight; waiting for its result.")
+            inflight_event.wait(timeout=120) # On timeout, fall through and process normally.
+
+        user_transcription = _resolve_transcription(audio_bytes, audio_digest)
+        del audio_bytes # Dead weight through the LLM/TTS phase below.
+        print(f"Transcription: '{user_transcription}'")
+
+        if not user_transcription:
+            if inflight_owner:
+                _inflight_end(audio_digest) # Nothing to wait for.
+            print("Transcription resulted in empty text; sending final frame only.")
+            return Response(frame_line(0, 0, b"", True), mimetype='application/x-ndjson')
+
+        # Full-response cache: the stored MP3 is one joined blob, so it goes
+        # out as a single frame carrying the first emotion code.
+        normalized_transcription = _normalize_transcription(user_transcription)
+        cached_response = _RESPONSE_CACHE.get(normalized_transcription)
+        if cached_response is not None:
+            if inflight_owner:
+                _inflight_end(audio_digest) # Served from cache; release waiters.
+            cached_audio, cached_codes = cached_response
+            print("Full response served from cache (single frame).")
+            body = frame_line(0, cached_codes[0] if cached_codes else 0, cached_audio, False) \
+                 + frame_line(1, 0, b"", True)
+            return Response(body, mimetype='application/x-ndjson')
+
+        print("Processing with OpenAI...")
+        session = session_future.result() # Overlapped with transcription above.
+        frame_queue = queue.Queue() # (emotion, sentence_audio) per sentence, terminated by None
+        result = {} # Filled with "emotion_codes" or "error" by the pipeline
+        emotions_ready = threading.Event()
+        on_complete = (lambda digest=audio_digest: _inflight_end(digest)) if inflight_owner else None
+        asyncio.run_coroutine_threadsafe(
+            # audio_queue=None: frames carry the audio here; a chunk queue
+            # nobody drains would just re-buffer the whole response.
+            process_interaction_and_speak(session, user_transcription, None, result, emotions_ready,
+                                          cache_key=normalized_transcription, on_complete=on_complete,
+                                          frame_queue=frame_queue),
+            _LOOP,
+        )
+        inflight_owner = False # Ownership handed to the pipeline.
+
+        # Relay frames as sentences finish; no waiting for the full response.
+        def frame_generator():
+            seq = 0
+            while True:
+                frame = frame_queue.get()
+                if frame is None:
+                    break
+                emotion_code, sentence_audio = frame
+                yield frame_line(seq, emotion_code, sentence_audio, False)
+                seq += 1
+            yield frame_line(seq, 0, b"", True)
+
+        print("Sending response as NDJSON sentence frames...")
+        return Response(frame_generator(), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        if inflight_owner and audio_digest:
+            _inflight_end(audio_digest) # Never leave waiters hanging on a failure.
+        print(f"Error in /interact_audio_stream endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Internal server error: {e}"}), 500
+
+# --- Cached component ids ---
+# Listing and scanning all vector stores/assistants on every startup costs
+# round-trips that grow with the account. The ids of the components we created
+# are stored in a small JSON file; startup then validates them with two
+# constant-time retrieve calls and only falls back to the list-scan when an
+# id has gone stale (e.g. deleted on the OpenAI side).
+_IDS_CACHE_FILE = ".musicalia_ids.json"
+
+def _load_cached_ids():
+    try:
+        if os.path.exists(_IDS_CACHE_FILE):
+            with open(_IDS_CACHE_FILE, "r") as ids_file:
+                return json.load(ids_file)
+    except Exception as e:
+        print(f"Could not load cached component ids: {e}")
+    return {}
+
+def _save_cached_ids(ids):
+    try:
+        with open(_IDS_CACHE_FILE, "w") as ids_file:
+            json.dump(ids, ids_file)
+    except Exception as e:
+        print(f"Could not persist component ids: {e}")
+
 # --- Initializes AI Components ---
-# Configures OpenAI Client, Vector Store (for PDF), Assistant, and Thread.
+# Configures OpenAI Client, Vector Store (for PDF), and Assistant.
 def initialize_ai_components(api_key):
-    global client, vector_store, assistant, thread
+    global client, vector_store, assistant
 
     if not api_key:
         print("FATAL ERROR: API Key not provided for initialization.")
@@ -288,16 +1092,55 @@ def initialize_ai_components(api_key):
 
     print("Initializing AI components with provided API key...")
     try:
-        client = OpenAI(api_key=api_key) # Use the provided API key
+        client = OpenAI(api_key=api_key, http_client=_HTTPX) # Provided API key + shared keep-alive pool
 
-        # Verify API key validity by making a simple request (e.g., listing models)
-        try:
-            client.models.list()
-            print("OpenAI API key verified.")
-        except Exception as api_auth_error:
-            print(f"FATAL ERROR: OpenAI API key seems invalid or connectivity issue: {api_auth_error}")
-            client = None # Ensure client is not set if key is bad
-            return False
+        # No dedicated "ping" to verify the key: the first retrieve/list call
+        # just below is the first real request, and an invalid key surfaces
+        # there as an AuthenticationError without costing an extra round-trip.
+
+        # Try the ids cached from a previous run first: two constant-time
+        # retrieve calls (issued in parallel) instead of listing and scanning
+        # the whole account.
+        cached_ids = _load_cached_ids()
+        vector_store = None
+        assistant = None
+        vs_future = assistant_future = None
+        with ThreadPoolExecutor(max_workers=2) as retrieve_pool:
+            if cached_ids.get("vector_store_id"):
+                vs_future = retrieve_pool.submit(client.vector_stores.retrieve, cached_ids["vector_store_id"])
+            if cached_ids.get("assistant_id"):
+                assistant_future = retrieve_pool.submit(client.beta.assistants.retrieve, cached_ids["assistant_id"])
+        if vs_future is not None:
+            try:
+                vector_store = vs_future.result()
+                print(f"Vector Store restored from cached id: {vector_store.id}")
+            except AuthenticationError:
+                raise
+            except Exception:
+                print("Cached Vector Store id is stale; falling back to the list scan.")
+        assistant_restored_from_cache = False # The config hash only certifies the cached assistant.
+        if assistant_future is not None:
+            try:
+                assistant = assistant_future.result()
+                assistant_restored_from_cache = True
+                print(f"Assistant restored from cached id: {assistant.id}")
+            except AuthenticationError:
+                raise
+            except Exception:
+                print("Cached Assistant id is stale; falling back to the list scan.")
+
+        # Cold path: whichever component the cache could not restore needs a
+        # list scan. The two scans are independent round-trips, so they run
+        # concurrently instead of back to back.
+        vector_stores_list = assistants_list = None
+        if vector_store is None or assistant is None:
+            with ThreadPoolExecutor(max_workers=2) as list_pool:
+                vs_list_future = list_pool.submit(client.vector_stores.list) if vector_store is None else None
+                assistants_future = list_pool.submit(client.beta.assistants.list) if assistant is None else None
+            if vs_list_future is not None:
+                vector_stores_list = vs_list_future.result()
+            if assistants_future is not None:
+                assistants_list = assistants_future.result()
 
         # Vector Store for searching 'Info.pdf'. Reuses if exists, creates if not.
         vector_store_name = "Musicalia Fado Archive"
@@ -307,11 +1150,10 @@ def initialize_ai_components(api_key):
         if not os.path.exists(file_path):
             print(f"WARNING: File '{file_path}' not found.")
 
-        vector_stores_list = client.vector_stores.list() # Use client.beta.vector_stores
-        existing_store = next((vs for vs in vector_stores_list.data if vs.name == vector_store_name), None)
+        if vector_stores_list is not None:
+            vector_store = next((vs for vs in vector_stores_list.data if vs.name == vector_store_name), None)
 
-        if existing_store:
-            vector_store = existing_store
+        if vector_store:
             print(f"Vector Store found: {vector_store.id}")
             # Optional: Check if file needs re-uploading or updating (more complex logic)
         else:
@@ -343,8 +1185,8 @@ def initialize_ai_components(api_key):
 
         # Assistant 'Musicalia'. Reuses if exists, creates if not.
         assistant_name = "Musicalia"
-        assistants_list = client.beta.assistants.list()
-        existing_assistant = next((a for a in assistants_list.data if a.name == assistant_name), None)
+        if assistants_list is not None:
+            assistant = next((a for a in assistants_list.data if a.name == assistant_name), None)
 
         instructions_text = "És a Musicalia, um avatar feminino inspirado na Amália Rodrigues, a icónica cantora de Fado portuguesa. \
         O teu propósito é envolver o público no intervalo de um concerto de música, partilhando histórias, curiosidades e o contexto histórico do Fado, de forma rica e poética. \
@@ -356,15 +1198,31 @@ def initialize_ai_components(api_key):
         Não mencionas fontes de informação nas tuas respostas, nem referências a artigos ou publicações. \
         Responde de forma simples, curta, sem títulos, listas, ou qualquer formatação. Evita qualquer tipo de formatação, como negritos ou itálicos ou ícones gráficos.\
         Não uses emojis em nenhuma das tuas respostas. \
-        Dá respostas curtas e diretas, com no máximo 3 a 5 frases."
+        Dá respostas curtas e diretas, com no máximo 3 a 5 frases. \
+        Sempre que o utilizador se referir a ti, deve ser como 'Musicalia'. \
+        O utilizador é o Gil Ferreira, o responsável pelo espetáculo. \
+        Ele é um músico, professor e gestor cultural, nascido na Venezuela em 1981, e agora eleito em funções públicas."
 
         tool_resources_config = {}
         if vector_store: # Only include file_search if vector_store was successfully created/found
             tool_resources_config = {"file_search": {"vector_store_ids": [vector_store.id]}}
 
-
-        if existing_assistant:
-            assistant = existing_assistant
+        # Hash of the configuration the assistant should carry. If it matches
+        # the hash recorded at the end of a previous startup, the stored
+        # assistant was already verified against this exact instructions and
+        # vector-store pair, so the drift check below (and its potential
+        # update call) can be skipped. The hash only certifies the assistant
+        # the cache pointed at: one recovered via the list scan instead may
+        # carry anything, so it always goes through the check. Editing
+        # instructions_text in the source changes the hash and re-triggers
+        # the check naturally.
+        config_hash = hashlib.blake2b(
+            (instructions_text + "|" + (vector_store.id if vector_store else "")).encode("utf-8")
+        ).hexdigest()
+
+        if assistant and assistant_restored_from_cache and cached_ids.get("config_hash") == config_hash:
+            print(f"Assistant found: {assistant.id} (configuration unchanged; drift check skipped)")
+        elif assistant:
             print(f"Assistant found: {assistant.id}")
             # Ensure the Vector Store and instructions are correct.
             needs_update = False
@@ -408,17 +1266,30 @@ def initialize_ai_components(api_key):
             )
             print(f"Assistant created: {assistant.id}")
 
-        # Conversation Thread. ALWAYS creates a new one at each server start
-        # to ensure a clean state for each server execution session. (Or upon successful initialization)
-        if thread:
-            print(f"Existing thread found: {thread.id}. Creating a new one for a clean session.")
+        # Remember the ids so the next startup can retrieve them directly
+        # instead of listing the account again.
+        _save_cached_ids({
+            "vector_store_id": vector_store.id if vector_store else None,
+            "assistant_id": assistant.id if assistant else None,
+            "config_hash": config_hash, # Lets the next boot skip the drift check.
+        })
 
-        thread = client.beta.threads.create()
-        print(f"New Thread created: {thread.id}")
+        # Conversation Threads are created lazily per session (see _get_session).
+        # Drop any sessions from a previous initialization so every client
+        # starts from a clean conversation.
+        with _sessions_lock:
+            _sessions.clear()
 
         print("AI components initialized successfully.")
         return True
 
+    except AuthenticationError as auth_error:
+        print(f"FATAL ERROR: OpenAI API key seems invalid: {auth_error}")
+        client = None # Ensure client is not set if key is bad
+        vector_store = None
+        assistant = None
+        return False
+
     except Exception as e:
         print(f"FATAL ERROR during AI initialization: {e}")
         traceback.print_exc()
@@ -426,47 +1297,98 @@ def initialize_ai_components(api_key):
         client = None
         vector_store = None
         assistant = None
-        thread = None
         return False
 
+# --- Warm start ---
+# If the API key is already available in the environment (it is configured in
+# render.yaml), initialize the AI components in the background at boot.
+# Initialization takes 5-15 s of OpenAI round-trips; doing it while Unity is
+# still connecting means /initialize_ai usually finds everything ready.
+_boot_api_key = os.environ.get("OPENAI_API_KEY")
+if _boot_api_key:
+    print("OPENAI_API_KEY found in environment; initializing AI components in background...")
+    threading.Thread(
+        target=_initialize_ai_synchronized, args=(_boot_api_key,), daemon=True
+    ).start()
+
+# --- Connection keepalive ---
+# Between turns the pooled TLS connection to the OpenAI API can outlive its
+# keepalive window and get closed by the peer, so the next turn pays a fresh
+# TCP + TLS handshake. A periodic cheap request keeps one connection warm.
+# Edge TTS opens a fresh connection per synthesis inside edge_tts, so there is
+# nothing of ours to keep warm on that side.
+_KEEPALIVE_INTERVAL = 240.0 # Seconds; inside the pool's 300 s keepalive_expiry
+
+async def _connection_keepalive():
+    while True:
+        await asyncio.sleep(_KEEPALIVE_INTERVAL)
+        if not ai_initialized_successfully:
+            continue # Nothing to keep warm before the first initialization.
+        try:
+            # Unauthenticated HEAD: a fast 4xx still exercises the connection.
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: _HTTPX.head("https://api.openai.com/v1")
+            )
+        except Exception as e:
+            print(f"Keepalive ping failed (harmless): {e}")
+
+asyncio.run_coroutine_threadsafe(_connection_keepalive(), _LOOP)
+
+# Precompiled cleanup patterns for clean_text_for_tts, built once at import
+# time and fused so each category of junk is stripped in a single pass.
+_MD_BOLD = re.compile(r"\*\*(.*?)\*\*")    # **bold**
+_MD_ITALIC = re.compile(r"\*(.*?)\*")      # *italic*
+_MD_UNDERSCORE = re.compile(r"_([^_]+)_")  # _italic_
+_MD_CODE = re.compile(r"`(.*?)`")          # `code`, non-greedy
+# List markers stay as two sequential passes: the bullet pass exposes new
+# line starts to the numbered pass ("- 1. x" -> "1. x" -> "x"), a composition
+# no single pattern reproduces for every input. Both are precompiled, and the
+# dirty-text gate below skips them entirely for plain replies.
+_LIST_BULLET = re.compile(r"^\s*[-•*]+\s*", re.MULTILINE)
+_LIST_NUM = re.compile(r"^\s*\d+[.)\-]+\s*", re.MULTILINE) # 1. 2) 3 - etc.
+_JUNK_CHARS = (
+    u"\U0001F600-\U0001F64F"  # emoticons
+    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+    u"\U0001F680-\U0001F6FF"  # transport & map symbols
+    u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    u"\u2600-\u26FF"          # miscellaneous symbols
+    u"\u2700-\u27BF"          # Dingbats
+    u"\uFE0F"                 # Variation selector, often part of emoji sequences
+    u"•▪★☆→←↑↓◆■«»“”"      # other graphic symbols and quotes
+)
+_JUNK_RE = re.compile("[" + _JUNK_CHARS + "]+", flags=re.UNICODE)
+_WS_RE_TTS = re.compile(r"\s+")
+
+# One cheap "anything to strip?" scan. The prompt forbids formatting, so most
+# replies are already plain text and every pass below would be a no-op; a
+# false positive here just means taking the full cleanup path.
+_DIRTY_RE = re.compile(
+    "[*_`\n\r\t" + _JUNK_CHARS + "]" + r"|  |^\s*[-•*]|^\s*\d+[.)\-]",
+    re.MULTILINE | re.UNICODE)
+
 # Removes formatting, emojis, and unwanted graphic elements before sending to TTS.
 def clean_text_for_tts(text):
+    # Early exit: nothing to strip and no whitespace to collapse.
+    if not _DIRTY_RE.search(text):
+        return text.strip()
+
     # Remove any Markdown markup (bold, italics, etc.)
-    text = re.sub(r"\*\*(.*?)\*\*", r"\1", text)  # **bold**
-    text = re.sub(r"\*(.*?)\*", r"\1", text)      # *italic*
-    text = re.sub(r"_([^_]+)_", r"\1", text)      # _italic_
-    # text = re.sub(r"`([^`]+)`", r"\1", text) # Fixed: code backticks, ensure it's not greedy
-    text = re.sub(r"`(.*?)`", r"\1", text)
-
-    # Remove lists and bullets
-    text = re.sub(r"^\s*[-•*]+\s*", "", text, flags=re.MULTILINE)
-
-    # Remove numbered lists (1. 2) 3 - etc.)
-    text = re.sub(r"^\s*\d+[\.\)\-]+\s*", "", text, flags=re.MULTILINE)
-
-    # Remove emojis (unicode emoji characters)
-    emoji_pattern = re.compile("["
-        u"\U0001F600-\U0001F64F"  # emoticons
-        u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-        u"\U0001F680-\U0001F6FF"  # transport & map symbols
-        u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        u"\u2600-\u26FF"          # miscellaneous symbols
-        u"\u2700-\u27BF"          # Dingbats
-        u"\uFE0F"                 # Variation selector, often part of emoji sequences
-        "]+", flags=re.UNICODE)
-    text = emoji_pattern.sub(r'', text)
-
-    # Remove other unwanted graphic symbols (optional)
-    text = re.sub(r"[•▪️✔️✖️➡️★☆→←↑↓◆■«»“”]", "", text) # Added more common symbols like quotes
-
-    # Remove multiple newlines and replace with a single space
-    text = re.sub(r"\n+", " ", text)
-
-    # Remove duplicate spaces and normalize
-    text = re.sub(r"\s+", " ", text).strip()
+    text = _MD_BOLD.sub(r"\1", text)
+    text = _MD_ITALIC.sub(r"\1", text)
+    text = _MD_UNDERSCORE.sub(r"\1", text)
+    text = _MD_CODE.sub(r"\1", text)
 
-    return text
+    # Remove bulleted, then numbered, list markers (order matters; see above)
+    text = _LIST_BULLET.sub("", text)
+    text = _LIST_NUM.sub("", text)
+
+    # Remove emojis and other unwanted graphic symbols in one pass
+    text = _JUNK_RE.sub("", text)
 
+    # Collapse runs of whitespace (newlines included) and normalize
+    text = _WS_RE_TTS.sub(" ", text).strip()
+
+    return text
 
 # --- Application Start ---
 if __name__ == '__main__':
@@ -477,9 +1399,12 @@ if __name__ == '__main__':
     print("Once initialized, ready to receive audio at /interact_audio")
     print("----------------------------------------------------")
 
-    # For Render (comment for local testing)
+    # Local/dev fallback only: Render now runs gunicorn with gthread workers
+    # (see render.yaml), which replaces Werkzeug's dev server in production.
+    # threaded=True lets concurrent /interact_audio requests overlap their
+    # multi-second Whisper/LLM/TTS I/O instead of queueing serially.
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port) 
+    app.run(host="0.0.0.0", port=port, threaded=True)
 
     # For Windows (uncomment for local testing)
     # app.run(debug=False, port=5000, threaded=True)